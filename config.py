@@ -139,12 +139,28 @@ class SettingsSection(PluginConfigBase):
             "order": 5, "step": 60,
         },
     )
+    max_concurrent_downloads: int = Field(
+        default=4,
+        json_schema_extra={
+            "hint": "单条动态的多张图片并发下载数上限。",
+            "label": "图片并发下载数",
+            "order": 6, "step": 1,
+        },
+    )
+    max_concurrent_checks: int = Field(
+        default=8,
+        json_schema_extra={
+            "hint": "同时检查的 UID 数上限，调小可降低风控概率。",
+            "label": "UID 并发检查数",
+            "order": 7, "step": 1,
+        },
+    )
     auto_like: bool = Field(
         default=False,
         json_schema_extra={
             "hint": "开启后，监控到 UP 主新动态时会自动点赞（需填写 SESSDATA 与 bili_jct）。",
             "label": "自动点赞新动态",
-            "order": 6,
+            "order": 8,
         },
     )
 
@@ -1,84 +1,85 @@
-"""
-订阅管理器
-用于存放指令增删的订阅
-"""
-import os
-import json
-import asyncio
-
-
-class SubscriptionManager:
-    def __init__(self):
-        self.file_path = os.path.join(os.path.dirname(__file__), "subscriptions.json")
-        self.lock = asyncio.Lock()
-        self.data = {"static": {}, "custom": {}, "names": {}}
-        self._load_sync()
-
-    def _load_sync(self):
-        if os.path.exists(self.file_path):
-            try:
-                with open(self.file_path, "r", encoding="utf-8") as f:
-                    self.data = json.load(f)
-            except Exception:
-                self.data = {"static": {}, "custom": {}, "names": {}}
-        else:
-            self.data = {"static": {}, "custom": {}, "names": {}}
-        self.data.setdefault("static", {})
-        self.data.setdefault("custom", {})
-        self.data.setdefault("names", {})
-
-    async def save(self):
-        async with self.lock:
-            def _write():
-                with open(self.file_path, "w", encoding="utf-8") as f:
-                    json.dump(self.data, f, indent=2, ensure_ascii=False)
-            await asyncio.to_thread(_write)
-
-    async def sync_static(self, config_users: list):
-        def _get(obj, key, default=None):
-            if isinstance(obj, dict):
-                return obj.get(key, default)
-            return getattr(obj, key, default)
-
-        new_static = {}
-        for sub in config_users:
-            raw_groups = _get(sub, "groups", []) or []
-            uids = []
-            uid = _get(sub, "uid")
-            if uid:
-                uids.append(str(uid))
-            uids_extra = _get(sub, "uids")
-            if isinstance(uids_extra, list):
-                uids.extend(str(x) for x in uids_extra)
-
-            for uid in uids:
-                merged = set(new_static.get(uid, []))
-                merged.update(int(g) for g in raw_groups)
-                new_static[uid] = sorted(merged)
-
-        async with self.lock:
-            self.data["static"] = new_static
-        await self.save()
-
-    def get_merged_map(self) -> dict:
-        merged = {}
-        for source in ["static", "custom"]:
-            for uid, groups in self.data.get(source, {}).items():
-                if uid not in merged:
-                    merged[uid] = set()
-                merged[uid].update(groups)
-        return merged
-
-    def get_name(self, uid: str) -> str:
-        return self.data.get("names", {}).get(str(uid), "")
-
-    async def set_name(self, uid: str, name: str):
-        if not name:
-            return
-        async with self.lock:
-            self.data.setdefault("names", {})[str(uid)] = name
-        await self.save()
-
-
-# 全局单例
-sub_manager = SubscriptionManager()
+"""
+订阅管理器
+用于存放指令增删的订阅
+"""
+import os
+import json
+import asyncio
+
+
+class SubscriptionManager:
+    def __init__(self):
+        self.file_path = os.path.join(os.path.dirname(__file__), "subscriptions.json")
+        self.lock = asyncio.Lock()
+        self.data = {"static": {}, "custom": {}, "names": {}}
+        self._load_sync()
+
+    def _load_sync(self):
+        if os.path.exists(self.file_path):
+            try:
+                with open(self.file_path, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except Exception:
+                self.data = {"static": {}, "custom": {}, "names": {}}
+        else:
+            self.data = {"static": {}, "custom": {}, "names": {}}
+        self.data.setdefault("static", {})
+        self.data.setdefault("custom", {})
+        self.data.setdefault("names", {})
+
+    async def save(self):
+        async with self.lock:
+            def _write():
+                with open(self.file_path, "w", encoding="utf-8") as f:
+                    json.dump(self.data, f, indent=2, ensure_ascii=False)
+            await asyncio.to_thread(_write)
+
+    async def sync_static(self, config_users: list):
+        def _get(obj, key, default=None):
+            if isinstance(obj, dict):
+                return obj.get(key, default)
+            return getattr(obj, key, default)
+
+        new_static = {}
+        for sub in config_users:
+            raw_groups = _get(sub, "groups", []) or []
+            uids = []
+            uid = _get(sub, "uid")
+            if uid:
+                uids.append(str(uid))
+            uids_extra = _get(sub, "uids")
+            if isinstance(uids_extra, list):
+                uids.extend(str(x) for x in uids_extra)
+
+            for uid in uids:
+                merged = set(new_static.get(uid, []))
+                merged.update(int(g) for g in raw_groups)
+                new_static[uid] = sorted(merged)
+
+        async with self.lock:
+            self.data["static"] = new_static
+        await self.save()
+
+    def get_merged_map(self) -> dict:
+        # dict 去重而非 set：推送顺序随配置顺序稳定，固定订阅的群先收到
+        # 冻结成 tuple：轮询每轮直接迭代，不必为防误改而复制
+        merged = {}
+        for source in ["static", "custom"]:
+            for uid, groups in self.data.get(source, {}).items():
+                bucket = merged.setdefault(uid, {})
+                bucket.update(dict.fromkeys(groups))
+        return {uid: tuple(bucket) for uid, bucket in merged.items()}
+
+    def get_name(self, uid: str) -> str:
+        return self.data.get("names", {}).get(str(uid), "")
+
+    async def set_name(self, uid: str, name: str):
+        if not name:
+            return
+        async with self.lock:
+            self.data.setdefault("names", {})[str(uid)] = name
+        await self.save()
+
+
+# 全局单例
+sub_manager = SubscriptionManager()
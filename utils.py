@@ -1,125 +1,227 @@
-"""
-工具函数
-"""
-import os
-import json
-import base64
-import asyncio
-import logging
-from typing import Any, Dict, Optional
-
-import aiohttp
-from bilibili_api import user
-
-logger = logging.getLogger("bilibili_dynamic_push")
-
-
-async def fetch_uname(uid: str, credential) -> str:
-    """根据 UID 拉取 B 站昵称，失败返回空串"""
-    try:
-        u = user.User(int(uid), credential=credential)
-        info = await u.get_user_info()
-        return info.get("name", "") or ""
-    except Exception as e:
-        logger.error(f"获取 UID {uid} 昵称失败: {e}")
-        return ""
-
-async def fetch_fans(uid: str, credential) -> int:
-    """获取当前粉丝数，失败返回 -1"""
-    try:
-        u = user.User(int(uid), credential=credential)
-        rel = await u.get_relation_info()
-        return int(rel.get("follower", 0))
-    except Exception as e:
-        logger.error(f"获取 UID {uid} 粉丝数失败: {e}")
-        return -1
-
-class BiliUtils:
-    @staticmethod
-    async def url_to_base64(url: str, session: aiohttp.ClientSession) -> Optional[str]:
-        if not url or not session:
-            return None
-        try:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    data = await resp.read()
-                    return base64.b64encode(data).decode("utf-8")
-        except Exception as e:
-            logger.error(f"图片下载失败: {url}, 错误: {e}")
-            return None
-
-    @staticmethod
-    def get_history_path() -> str:
-        return os.path.join(os.path.dirname(__file__), "history.json")
-
-    @staticmethod
-    def load_history() -> Dict[str, Any]:
-        path = BiliUtils.get_history_path()
-        if not os.path.exists(path):
-            return {}
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            # JSON 损坏时不能静默返回空，否则所有 UP 主会被当作"首次初始化"导致漏推
-            logger.error(f"❌ 加载 history.json 失败: {e}，已备份损坏文件并重建。")
-            try:
-                bak = path + ".broken"
-                os.replace(path, bak)
-                logger.error(f"   损坏文件已备份至: {bak}")
-            except Exception as e2:
-                logger.error(f"   备份损坏文件失败: {e2}")
-            return {}
-
-    @staticmethod
-    async def save_history(data: Dict[str, Any]):
-        path = BiliUtils.get_history_path()
-        tmp_path = path + ".tmp"
-
-        def _write():
-            # 先写临时文件再 rename，避免写一半进程被杀导致 JSON 损坏
-            with open(tmp_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            os.replace(tmp_path, path)
-
-        try:
-            await asyncio.to_thread(_write)
-        except Exception as e:
-            logger.error(f"❌ 保存 history.json 失败: {e}")
-
-    @staticmethod
-    def format_duration(seconds: float) -> str:
-        m, s = divmod(int(seconds), 60)
-        h, m = divmod(m, 60)
-        if h > 0:
-            return f"{h}小时{m}分{s}秒"
-        return f"{m}分{s}秒"
-
-    @staticmethod
-    def get_milestone_step(fans: int) -> int:
-        """根据当前粉丝数返回里程碑步长，<1万返回 0 表示不提醒"""
-        if fans < 10_000:
-            return 0
-        if fans < 100_000:        # 1万 ~ 9.9999万
-            return 10_000
-        if fans < 1_000_000:      # 10万 ~ 99.9999万
-            return 100_000
-        if fans < 10_000_000:     # 100万 ~ 999.9999万
-            return 500_000
-        return 1_000_000          # 1000万以上
-
-    @staticmethod
-    def get_current_milestone(fans: int) -> int:
-        """向下取整到当前里程碑"""
-        step = BiliUtils.get_milestone_step(fans)
-        if step == 0:
-            return 0
-        return (fans // step) * step
-
-    @staticmethod
-    def format_fans(n: int) -> str:
-        """10000 -> 1万, 1000000 -> 100万, 10000000 -> 1000万"""
-        if n >= 10000:
-            v = n / 10000
-            return f"{v:.4f}".rstrip("0").rstrip(".") + "万"
-        return str(n)
+"""
+工具函数
+"""
+import os
+import json
+import time
+import asyncio
+import binascii
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import aiohttp
+from bilibili_api import user
+
+try:
+    import orjson  # 可选依赖：C 实现的 JSON，历史文件大时读写快一个量级
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("bilibili_dynamic_push")
+
+# 超过该大小的图片直接放弃，避免把超大原图整个读进内存
+_IMG_MAX_BYTES = 20 * 1024 * 1024
+
+# URL -> (缓存时间, base64) 的小 LRU：直播封面、转发图在相邻轮次里经常重复出现
+# 带 TTL，CDN 上同地址换图（罕见但存在）最多延迟 10 分钟感知
+_IMG_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_IMG_CACHE_MAX = 128
+_IMG_CACHE_TTL = 600
+
+
+async def fetch_uname(uid: str, credential) -> str:
+    """根据 UID 拉取 B 站昵称，失败返回空串"""
+    try:
+        u = user.User(int(uid), credential=credential)
+        info = await u.get_user_info()
+        return info.get("name", "") or ""
+    except Exception as e:
+        logger.error(f"获取 UID {uid} 昵称失败: {e}")
+        return ""
+
+async def fetch_fans(uid: str, credential) -> int:
+    """获取当前粉丝数，失败返回 -1"""
+    try:
+        u = user.User(int(uid), credential=credential)
+        rel = await u.get_relation_info()
+        return int(rel.get("follower", 0))
+    except Exception as e:
+        logger.error(f"获取 UID {uid} 粉丝数失败: {e}")
+        return -1
+
+class AsyncRateLimiter:
+    """极简令牌桶：限制群发消息的总速率，并发推送共用同一配额。"""
+
+    def __init__(self, max_rate: float, time_period: float = 1.0):
+        self._interval = time_period / max_rate
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self._interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+class BiliUtils:
+    @staticmethod
+    async def url_to_base64(url: str, session: aiohttp.ClientSession) -> Optional[str]:
+        if not url or not session:
+            return None
+
+        cached = _IMG_CACHE.get(url)
+        if cached is not None:
+            ts, b64 = cached
+            if time.monotonic() - ts < _IMG_CACHE_TTL:
+                _IMG_CACHE.move_to_end(url)
+                return b64
+            del _IMG_CACHE[url]
+
+        try:
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    return None
+                try:
+                    length = int(resp.headers.get("Content-Length") or 0)
+                except (TypeError, ValueError):
+                    length = 0
+                if length > _IMG_MAX_BYTES:
+                    logger.warning(f"图片过大({length}B)，跳过: {url}")
+                    return None
+                # 分块读入 bytearray，不经过 resp.read() 的整体缓冲
+                buf = bytearray()
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    buf.extend(chunk)
+                    if len(buf) > _IMG_MAX_BYTES:
+                        logger.warning(f"图片超出大小上限，中断下载: {url}")
+                        return None
+                # b2a_base64 直达 C 实现，省掉 base64 包装层的一次中间分配
+                b64 = binascii.b2a_base64(buf, newline=False).decode("ascii")
+                _IMG_CACHE[url] = (time.monotonic(), b64)
+                if len(_IMG_CACHE) > _IMG_CACHE_MAX:
+                    _IMG_CACHE.popitem(last=False)
+                return b64
+        except Exception as e:
+            logger.error(f"图片下载失败: {url}, 错误: {e}")
+            return None
+
+    @staticmethod
+    def get_history_path() -> str:
+        """旧版整体式 history.json 的路径，仅用于一次性迁移。"""
+        return os.path.join(os.path.dirname(__file__), "history.json")
+
+    @staticmethod
+    def get_history_dir() -> str:
+        return os.path.join(os.path.dirname(__file__), "history")
+
+    @staticmethod
+    def load_history() -> Dict[str, Any]:
+        """加载全部历史记录：分片目录优先，旧版单文件自动迁移为分片。"""
+        data: Dict[str, Any] = {}
+
+        # 旧版单文件：读进来后拆成分片，原文件改名留档
+        legacy = BiliUtils.get_history_path()
+        if os.path.exists(legacy):
+            try:
+                with open(legacy, "rb") as f:
+                    raw = f.read()
+                data = orjson.loads(raw) if orjson else json.loads(raw)
+                for uid, entry in data.items():
+                    BiliUtils.save_history_shard_sync(uid, entry)
+                os.replace(legacy, legacy + ".migrated")
+                logger.info(f"✅ history.json 已迁移为分片存储（{len(data)} 个 UID）")
+            except Exception as e:
+                # JSON 损坏时不能静默返回空，否则所有 UP 主会被当作"首次初始化"导致漏推
+                logger.error(f"❌ 迁移 history.json 失败: {e}，已备份损坏文件并重建。")
+                try:
+                    bak = legacy + ".broken"
+                    os.replace(legacy, bak)
+                    logger.error(f"   损坏文件已备份至: {bak}")
+                except Exception as e2:
+                    logger.error(f"   备份损坏文件失败: {e2}")
+                data = {}
+
+        hist_dir = BiliUtils.get_history_dir()
+        if os.path.isdir(hist_dir):
+            for fname in os.listdir(hist_dir):
+                if not fname.endswith(".json"):
+                    continue
+                uid = fname[:-5]
+                try:
+                    with open(os.path.join(hist_dir, fname), "rb") as f:
+                        raw = f.read()
+                    data[uid] = orjson.loads(raw) if orjson else json.loads(raw)
+                except Exception as e:
+                    logger.error(f"❌ 加载历史分片 {fname} 失败: {e}，跳过该 UID。")
+        return data
+
+    @staticmethod
+    def save_history_shard_sync(uid: str, entry: Any):
+        """同步写单个 UID 的历史分片，供线程池与进程退出兜底调用。"""
+        hist_dir = BiliUtils.get_history_dir()
+        path = os.path.join(hist_dir, f"{uid}.json")
+        tmp_path = path + ".tmp"
+        try:
+            os.makedirs(hist_dir, exist_ok=True)
+            # 先写临时文件再 rename，避免写一半进程被杀导致 JSON 损坏
+            # 热路径不缩进，省一半字节；要排查时用编辑器格式化即可
+            if orjson:
+                payload = orjson.dumps(entry)
+            else:
+                payload = json.dumps(
+                    entry, separators=(",", ":"), ensure_ascii=False
+                ).encode("utf-8")
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"❌ 保存历史分片 {uid}.json 失败: {e}")
+
+    @staticmethod
+    async def save_history_shard(uid: str, entry: Any):
+        await asyncio.to_thread(BiliUtils.save_history_shard_sync, uid, entry)
+
+    @staticmethod
+    def format_duration(seconds: float) -> str:
+        m, s = divmod(int(seconds), 60)
+        h, m = divmod(m, 60)
+        if h > 0:
+            return f"{h}小时{m}分{s}秒"
+        return f"{m}分{s}秒"
+
+    @staticmethod
+    def get_milestone_step(fans: int) -> int:
+        """根据当前粉丝数返回里程碑步长，<1万返回 0 表示不提醒"""
+        if fans < 10_000:
+            return 0
+        if fans < 100_000:        # 1万 ~ 9.9999万
+            return 10_000
+        if fans < 1_000_000:      # 10万 ~ 99.9999万
+            return 100_000
+        if fans < 10_000_000:     # 100万 ~ 999.9999万
+            return 500_000
+        return 1_000_000          # 1000万以上
+
+    @staticmethod
+    def get_current_milestone(fans: int) -> int:
+        """向下取整到当前里程碑"""
+        step = BiliUtils.get_milestone_step(fans)
+        if step == 0:
+            return 0
+        return (fans // step) * step
+
+    @staticmethod
+    def format_fans(n: int) -> str:
+        """10000 -> 1万, 1000000 -> 100万, 10000000 -> 1000万"""
+        if n >= 10000:
+            v = n / 10000
+            return f"{v:.4f}".rstrip("0").rstrip(".") + "万"
+        return str(n)